@@ -4,7 +4,10 @@ Manager and Serializer for Roles.
 import logging
 
 from sqlalchemy import false
-from sqlalchemy.orm import exc as sqlalchemy_exceptions
+from sqlalchemy.orm import (
+    exc as sqlalchemy_exceptions,
+    joinedload,
+)
 
 import galaxy.exceptions
 from galaxy import model
@@ -40,8 +43,19 @@ class RoleManager(base.ModelManager):
 
         :raises: InconsistentDatabase, RequestParameterInvalidException, InternalServerError
         """
+        return self._get(trans, decoded_role_id)
+
+    def get_with_users(self, trans: ProvidesUserContext, decoded_role_id):
+        """
+        Load the role as `get` does, along with its user associations and their users
+        in the same query.
+        """
+        return self._get(trans, decoded_role_id, joinedload(Role.users).joinedload(self.user_assoc.user))
+
+    def _get(self, trans: ProvidesUserContext, decoded_role_id, *options):
         try:
-            role = self.session().query(self.model_class).filter(self.model_class.id == decoded_role_id).one()
+            query = self.session().query(self.model_class).options(*options)
+            role = query.filter(self.model_class.id == decoded_role_id).one()
         except sqlalchemy_exceptions.MultipleResultsFound:
             raise galaxy.exceptions.InconsistentDatabase("Multiple roles found with the same id.")
         except sqlalchemy_exceptions.NoResultFound:
@@ -28,7 +28,10 @@ attribute change to a model object.
 import datetime
 import logging
 import re
-from functools import partial
+from functools import (
+    lru_cache,
+    partial,
+)
 from typing import (
     Any,
     Callable,
@@ -378,6 +381,21 @@ class ModelManager:
         items = self._apply_fn_filters_gen(items, fn_filters)
         return list(self._apply_fn_limit_offset_gen(items, limit, offset))
 
+    def count(self, filters=None, limit=None, offset=None) -> int:
+        """
+        Returns the number of objects `list` would return for the given filters, limit, and offset
+        """
+        orm_filters, fn_filters = self._split_filters(filters)
+        if fn_filters:
+            # functional filters can only be applied to loaded models
+            return len(self.list(filters=filters, limit=limit, offset=offset))
+
+        # order doesn't change the count, and must be cleared before any limit or offset is applied
+        query = self.query(eagerloads=False, filters=orm_filters)
+        query = query.with_entities(self.model_class.table.c.id).order_by(None)
+        ids = self._apply_orm_limit_offset(query, limit, offset).subquery()
+        return self.session().scalar(sqlalchemy.select(sqlalchemy.func.count()).select_from(ids))
+
     def _split_filters(self, filters):
         """
         Splits `filters` into a tuple of two lists:
@@ -637,6 +655,8 @@ class ModelSerializer(HasAModelManager[T]):
         #   inspired by model.dict_{view}_visible_keys
         self.views = {}
         self.default_view = None
+        # memoize the keys resolved by serialize_to_view per (view, keys, default_view)
+        self._cached_view_keys = lru_cache(maxsize=64)(self._resolve_view_keys)
 
     @staticmethod
     def url_for(*args, context=None, **kwargs):
@@ -668,6 +688,7 @@ class ModelSerializer(HasAModelManager[T]):
         key_list = list(set(key_list + self.views.get(include_keys_from, [])))
         self.views[view_name] = key_list
         self.serializable_keyset.update(key_list)
+        self._cached_view_keys.cache_clear()
         return key_list
 
     def serialize(self, item, keys, **context):
@@ -757,21 +778,26 @@ class ModelSerializer(HasAModelManager[T]):
         """
 
         # TODO: default view + view makes no sense outside the API.index context - move default view there
-        all_keys = []
-        keys = keys or []
+        all_keys = self._cached_view_keys(view, tuple(keys or ()), default_view or self.default_view)
+        # copy: serializers may alter the list of keys they're given
+        return self.serialize(item, list(all_keys), **context)
+
+    def _resolve_view_keys(self, view, keys, default_view):
+        """
+        Combine the keys in the named `view` (or `default_view`) and the tuple `keys`
+        into a tuple of the keys to serialize.
+        """
         # chose explicit over concise here
         if view:
             if keys:
-                all_keys = self._view_to_keys(view) + keys
+                return tuple(self._view_to_keys(view)) + keys
             else:
-                all_keys = self._view_to_keys(view)
+                return tuple(self._view_to_keys(view))
         else:
             if keys:
-                all_keys = keys
+                return keys
             else:
-                all_keys = self._view_to_keys(default_view)
-
-        return self.serialize(item, all_keys, **context)
+                return tuple(self._view_to_keys(default_view))
 
     def _view_to_keys(self, view=None):
         """
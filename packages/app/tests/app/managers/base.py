@@ -2,28 +2,37 @@
 """
 
 import json
+import os
 import unittest
+from collections import Counter
 
 import sqlalchemy
 
 from galaxy.app_unittest_utils import galaxy_mock
 from galaxy.managers.users import UserManager
+from galaxy.util import asbool
 
 # =============================================================================
 admin_email = "admin@admin.admin"
 admin_users = admin_email
 default_password = "123456"
+# set GALAXY_TEST_VERBOSE to print the progress messages passed to BaseTestCase.log
+verbose = asbool(os.environ.get("GALAXY_TEST_VERBOSE", False))
+
+
+def _quiet_log(*args, **kwargs):
+    pass
 
 
 # =============================================================================
 class BaseTestCase(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
-        print("\n", "-" * 20, "begin class", cls)
+        cls.log("\n", "-" * 20, "begin class", cls)
 
     @classmethod
     def tearDownClass(cls):
-        print("\n", "-" * 20, "end class", cls)
+        cls.log("\n", "-" * 20, "end class", cls)
 
     def setUp(self):
         self.log("." * 20, "begin test", self)
@@ -47,14 +56,31 @@ class BaseTestCase(unittest.TestCase):
     def tearDown(self):
         self.log("." * 20, "end test", self, "\n")
 
-    def log(self, *args, **kwargs):
-        print(*args, **kwargs)
+    # chosen once at import so quiet runs skip print entirely
+    log = staticmethod(print if verbose else _quiet_log)
+
+    def insert_fixture_rows(self, session, mappings):
+        """
+        Insert rows for fixture data that only needs to exist, bypassing the managers.
+
+        `mappings` maps model classes to lists of column value dictionaries; each class
+        gets a single (executemany) INSERT.
+        """
+        for model_class, rows in mappings.items():
+            if rows:
+                session.execute(model_class.__table__.insert(), rows)
 
     # ---- additional test types
     TYPES_NEEDING_NO_SERIALIZERS = (str, bool, type(None), int, float)
 
     def assertKeys(self, obj, key_list):
-        self.assertEqual(sorted(obj.keys()), sorted(key_list))
+        keys = frozenset(obj.keys())
+        expected = frozenset(key_list)
+        if len(expected) != len(key_list):
+            duplicates = sorted(key for key, count in Counter(key_list).items() if count > 1)
+            self.fail(f"Duplicate keys: {duplicates}")
+        if keys != expected:
+            self.fail(f"Missing keys: {sorted(expected - keys)}, unexpected keys: {sorted(keys - expected)}")
 
     def assertHasKeys(self, obj, key_list):
         for key in key_list:
@@ -69,9 +95,11 @@ class BaseTestCase(unittest.TestCase):
         # TODO: len mod 8 and hex re
         self.assertTrue(True, "is nullable basestring: " + str(item))
 
-    def assertEncodedId(self, item):
+    def assertEncodedId(self, item, expected=None):
         if not isinstance(item, str):
             self.fail("Non-string: " + str(type(item)))
+        if expected is not None:
+            self.assertEqual(item, expected)
         # TODO: len mod 8 and hex re
         self.assertTrue(True, "is id: " + item)
 
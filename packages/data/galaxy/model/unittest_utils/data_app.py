@@ -8,7 +8,11 @@ galaxy-data.
 import os
 import shutil
 import tempfile
-from typing import Optional
+from typing import (
+    Any,
+    Dict,
+    Optional,
+)
 
 from galaxy import (
     model,
@@ -37,6 +41,7 @@ class GalaxyDataTestConfig(Bunch):
 
     security: IdEncodingHelper
     database_connection: str
+    database_engine_options: Optional[Dict[str, Any]]
     root: str
     data_dir: str
     _remove_root: bool
@@ -53,6 +58,7 @@ class GalaxyDataTestConfig(Bunch):
 
         self.security = IdEncodingHelper(id_secret=GALAXY_TEST_UNITTEST_SECRET)
         self.database_connection = kwd.get("database_connection", GALAXY_TEST_IN_MEMORY_DB_CONNECTION)
+        self.database_engine_options = kwd.get("database_engine_options")
 
         # objectstore config values...
         self.object_store_config_file = ""
@@ -87,7 +93,13 @@ class GalaxyDataTestApp:
         self.config = config
         self.security = config.security
         self.object_store = objectstore.build_object_store_from_config(self.config)
-        self.model = init("/tmp", self.config.database_connection, create_tables=True, object_store=self.object_store)
+        self.model = init(
+            "/tmp",
+            self.config.database_connection,
+            self.config.database_engine_options,
+            create_tables=True,
+            object_store=self.object_store,
+        )
         self.security_agent = self.model.security_agent
         self.tag_handler = GalaxyTagHandler(self.model.context)
         self.init_datatypes()
@@ -1,21 +1,34 @@
 """
 """
 import unittest
+from collections import defaultdict
+from functools import lru_cache
 from unittest import mock
 
 import sqlalchemy
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+from sqlalchemy.pool import StaticPool
 
 from galaxy import (
     exceptions,
     model,
 )
-from galaxy.managers.base import SkipAttribute
+from galaxy.app_unittest_utils import galaxy_mock
+from galaxy.managers.base import (
+    parsed_filter,
+    SkipAttribute,
+)
 from galaxy.managers.datasets import (
     DatasetManager,
     DatasetSerializer,
 )
 from galaxy.managers.roles import RoleManager
-from .base import BaseTestCase
+from galaxy.managers.users import UserManager
+from .base import (
+    admin_users,
+    BaseTestCase,
+)
 
 # =============================================================================
 default_password = "123456"
@@ -24,10 +37,195 @@ user3_data = dict(email="user3@user3.user3", username="user3", password=default_
 
 
 # =============================================================================
-class DatasetManagerTestCase(BaseTestCase):
-    def set_up_managers(self):
-        super().set_up_managers()
-        self.dataset_manager = DatasetManager(self.app)
+class BaseDatasetTestCase(BaseTestCase):
+    """
+    Builds the mock app and managers once per class and runs each test inside
+    an outer transaction that is rolled back in tearDown.
+    """
+
+    #: the number of blank datasets created for the class and shared by its tests
+    dataset_pool_size = 0
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        admin_users_list = [u for u in admin_users.split(",") if u]
+        # a single shared connection keeps the in-memory database visible to every thread, and
+        # AUTOCOMMIT stops pysqlite from beginning and committing transactions on its own
+        # (see set_up_class_engine)
+        cls.trans = galaxy_mock.MockTrans(
+            admin_users=admin_users,
+            admin_users_list=admin_users_list,
+            database_engine_options=dict(poolclass=StaticPool, isolation_level="AUTOCOMMIT"),
+        )
+        cls.app = cls.trans.app
+        # ids decode the same way for the life of the class's app
+        cls.decode_id = staticmethod(lru_cache(maxsize=256)(cls.app.security.decode_id))
+        cls.set_up_class_engine()
+        cls.set_up_class_managers()
+        cls.set_up_class_users()
+        cls.set_up_class_datasets()
+        cls.set_up_class_encoded_ids()
+        cls.detach_class_fixtures()
+
+    @classmethod
+    def set_up_class_engine(cls):
+        """
+        Have the engine emit BEGIN itself, so that the SAVEPOINTs of each test nest inside
+        a real transaction that tearDown can roll back.
+
+        With pysqlite's own transaction handling turned off by the AUTOCOMMIT engine option,
+        nothing else begins one: left alone, the first SAVEPOINT would be the outermost
+        transaction and its RELEASE a COMMIT.
+
+        See: https://docs.sqlalchemy.org/en/14/dialects/sqlite.html#serializable-isolation-savepoints-transactional-ddl
+        """
+
+        @sqlalchemy.event.listens_for(cls.app.model.engine, "begin")
+        def begin(connection):
+            connection.exec_driver_sql("BEGIN")
+
+    @classmethod
+    def set_up_class_managers(cls):
+        cls.user_manager = cls.app[UserManager]
+        cls.dataset_manager = DatasetManager(cls.app)
+
+    @classmethod
+    def set_up_class_users(cls):
+        """
+        Create the fixture users and their private roles once, outside of any test's transaction.
+        """
+        cls._fixture_users = {}
+        cls._fixture_private_roles = {}
+        for user_data in (user2_data, user3_data):
+            user = cls.user_manager.create(**user_data)
+            cls._fixture_users[user_data["email"]] = user
+            cls._fixture_private_roles[user_data["email"]] = cls.user_manager.private_role(user)
+
+    @classmethod
+    def set_up_class_datasets(cls):
+        """
+        Create the pool of blank datasets once, outside of any test's transaction.
+        """
+        cls.dataset_pool = [cls.dataset_manager.create() for _ in range(cls.dataset_pool_size)]
+
+    @classmethod
+    def set_up_class_encoded_ids(cls):
+        """
+        Encode the ids of the pooled datasets once, while they can still be loaded from the class's session.
+        """
+        encode_id = cls.app.security.encode_id
+        cls.encoded_ids = {dataset.id: encode_id(dataset.id) for dataset in cls.dataset_pool}
+
+    @classmethod
+    def detach_class_fixtures(cls):
+        """
+        Load the fixtures' committed state and detach them from the class's session.
+
+        Tests merge them back with `load=False`, so they arrive loaded and need no SELECT.
+        """
+        session = cls.app.model.session
+        session.flush()
+        fixtures = [*cls._fixture_users.values(), *cls._fixture_private_roles.values(), *cls.dataset_pool]
+        for fixture in fixtures:
+            session.refresh(fixture)
+        session.expunge_all()
+        session.remove()
+
+    def setUp(self):
+        self.log("." * 20, "begin test", self)
+        self.set_up_transaction()
+        self.set_up_trans()
+
+    def set_up_transaction(self):
+        """
+        Bind the app's scoped session to a connection with an open outer transaction
+        and a SAVEPOINT that is restarted whenever the session ends it.
+
+        See: https://docs.sqlalchemy.org/en/14/orm/session_transaction.html#joining-a-session-into-an-external-transaction-such-as-for-test-suites
+        """
+        scoped_session = self.app.model.session
+        self.connection = self.app.model.engine.connect()
+        self.transaction = self.connection.begin()
+        scoped_session.remove()
+        scoped_session.configure(bind=self.connection)
+        self.nested = self.connection.begin_nested()
+
+        @sqlalchemy.event.listens_for(scoped_session(), "after_transaction_end")
+        def restart_savepoint(session, transaction):
+            if not self.nested.is_active:
+                self.nested = self.connection.begin_nested()
+
+    def set_config(self, **kwargs):
+        """
+        Override app config values for the current test only, since the app is shared by the class.
+        """
+        for key, value in kwargs.items():
+            patcher = mock.patch.object(self.app.config, key, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def get_user(self, user_data):
+        """
+        Return the fixture user created from `user_data`, attached to this test's session.
+        """
+        return self.app.model.session.merge(self._fixture_users[user_data["email"]], load=False)
+
+    def get_private_role(self, user):
+        """
+        Return the private role of the fixture user `user`, attached to this test's session.
+        """
+        return self.app.model.session.merge(self._fixture_private_roles[user.email], load=False)
+
+    def get_dataset(self, index=0):
+        """
+        Return the pooled blank dataset at `index`, attached to this test's session.
+
+        Changes made to it are rolled back with the rest of the test.
+        """
+        return self.app.model.session.merge(self.dataset_pool[index], load=False)
+
+    def by_id_with_permissions(self, id):
+        """
+        Re-fetch a dataset with its permissions, their roles, and those roles' users in one pass.
+        """
+        query = self.dataset_manager.query(filters=(model.Dataset.id == id)).options(
+            selectinload(model.Dataset.actions)
+            .selectinload(model.DatasetPermissions.role)
+            .selectinload(model.Role.users)
+        )
+        return query.populate_existing().one()
+
+    def permission_roles_by_action(self, datasets):
+        """
+        Return a dictionary mapping each permission action to a dictionary of
+        dataset id and the frozenset of role ids granted that action, for `datasets`.
+        """
+        permission = model.DatasetPermissions
+        stmt = select(permission.action, permission.dataset_id, permission.role_id).where(
+            permission.dataset_id.in_([dataset.id for dataset in datasets])
+        )
+        role_ids = defaultdict(lambda: defaultdict(set))
+        for action, dataset_id, role_id in self.trans.sa_session.execute(stmt):
+            role_ids[action][dataset_id].add(role_id)
+        return {
+            action: {dataset_id: frozenset(ids) for dataset_id, ids in by_dataset.items()}
+            for action, by_dataset in role_ids.items()
+        }
+
+    def tearDown(self):
+        self.app.model.session.remove()
+        self.transaction.rollback()
+        self.connection.close()
+        super().tearDown()
+
+
+# =============================================================================
+class DatasetManagerTestCase(BaseDatasetTestCase):
+    dataset_pool_size = 2
+
+    def ids(self, items):
+        return [item.id for item in items]
 
     def test_create(self):
         self.log("should be able to create a new Dataset")
@@ -36,23 +234,32 @@ class DatasetManagerTestCase(BaseTestCase):
         self.assertEqual(dataset1, self.trans.sa_session.query(model.Dataset).get(dataset1.id))
 
     def test_base(self):
-        dataset1 = self.dataset_manager.create()
-        dataset2 = self.dataset_manager.create()
+        dataset1 = self.get_dataset(0)
+        dataset2 = self.get_dataset(1)
 
         self.log("should be able to query")
-        datasets = self.trans.sa_session.query(model.Dataset).all()
-        self.assertEqual(self.dataset_manager.list(), datasets)
+        dataset_ids = [dataset1.id, dataset2.id]
+        self.assertEqual(self.ids(self.dataset_manager.list()), dataset_ids)
         self.assertEqual(self.dataset_manager.one(filters=(model.Dataset.id == dataset1.id)), dataset1)
         self.assertEqual(self.dataset_manager.by_id(dataset1.id), dataset1)
         self.assertEqual(self.dataset_manager.by_ids([dataset2.id, dataset1.id]), [dataset2, dataset1])
 
         self.log("should be able to limit and offset")
-        self.assertEqual(self.dataset_manager.list(limit=1), datasets[0:1])
-        self.assertEqual(self.dataset_manager.list(offset=1), datasets[1:])
-        self.assertEqual(self.dataset_manager.list(limit=1, offset=1), datasets[1:2])
-
-        self.assertEqual(self.dataset_manager.list(limit=0), [])
-        self.assertEqual(self.dataset_manager.list(offset=3), [])
+        self.assertEqual(self.ids(self.dataset_manager.list(limit=1)), dataset_ids[0:1])
+        self.assertEqual(self.ids(self.dataset_manager.list(offset=1)), dataset_ids[1:])
+        self.assertEqual(self.ids(self.dataset_manager.list(limit=1, offset=1)), dataset_ids[1:2])
+
+        self.log("should be able to count without loading")
+        self.assertEqual(self.dataset_manager.count(), len(dataset_ids))
+        self.assertEqual(self.dataset_manager.count(limit=1, offset=1), 1)
+        self.assertEqual(self.dataset_manager.count(limit=0), 0)
+        self.assertEqual(self.dataset_manager.count(offset=3), 0)
+        self.assertEqual(self.dataset_manager.count(filters=(model.Dataset.id == dataset1.id)), 1)
+
+        self.log("should count functional filters on the loaded models")
+        is_dataset1 = parsed_filter("function", lambda dataset: dataset.id == dataset1.id)
+        self.assertEqual(self.dataset_manager.count(filters=[is_dataset1]), 1)
+        self.assertEqual(self.dataset_manager.count(filters=[is_dataset1], offset=1), 0)
 
         self.log("should be able to order")
         self.assertEqual(
@@ -60,7 +267,7 @@ class DatasetManagerTestCase(BaseTestCase):
         )
 
     def test_delete(self):
-        item1 = self.dataset_manager.create()
+        item1 = self.get_dataset()
 
         self.log("should be able to delete and undelete a dataset")
         self.assertFalse(item1.deleted)
@@ -70,8 +277,8 @@ class DatasetManagerTestCase(BaseTestCase):
         self.assertFalse(item1.deleted)
 
     def test_purge_allowed(self):
-        self.trans.app.config.allow_user_dataset_purge = True
-        item1 = self.dataset_manager.create()
+        self.set_config(allow_user_dataset_purge=True)
+        item1 = self.get_dataset()
 
         self.log("should purge a dataset if config does allow")
         self.assertFalse(item1.purged)
@@ -82,8 +289,8 @@ class DatasetManagerTestCase(BaseTestCase):
         self.assertTrue(item1.deleted)
 
     def test_purge_not_allowed(self):
-        self.trans.app.config.allow_user_dataset_purge = False
-        item1 = self.dataset_manager.create()
+        self.set_config(allow_user_dataset_purge=False)
+        item1 = self.get_dataset()
 
         self.log("should raise an error when purging a dataset if config does not allow")
         self.assertFalse(item1.purged)
@@ -101,7 +308,7 @@ class DatasetManagerTestCase(BaseTestCase):
         self.assertEqual(manage_permissions, [])
         self.assertEqual(access_permissions, [])
 
-        user3 = self.user_manager.create(**user3_data)
+        user3 = self.get_user(user3_data)
         self.log("a dataset without permissions shouldn't be manageable to just anyone")
         self.assertFalse(self.dataset_manager.permissions.manage.is_permitted(dataset, user3))
         self.log("a dataset without permissions should be accessible")
@@ -122,8 +329,8 @@ class DatasetManagerTestCase(BaseTestCase):
             "should be able to create a new Dataset and give it some permissions that actually, you know, "
             "might work if there's any justice in this universe"
         )
-        owner = self.user_manager.create(**user2_data)
-        owner_private_role = self.user_manager.private_role(owner)
+        owner = self.get_user(user2_data)
+        owner_private_role = self.get_private_role(owner)
         dataset = self.dataset_manager.create(manage_roles=[owner_private_role])
 
         permissions = self.dataset_manager.permissions.get(dataset)
@@ -134,7 +341,8 @@ class DatasetManagerTestCase(BaseTestCase):
         self.assertIsInstance(manage_permissions[0], model.DatasetPermissions)
         self.assertEqual(access_permissions, [])
 
-        user3 = self.user_manager.create(**user3_data)
+        user3 = self.get_user(user3_data)
+        dataset = self.by_id_with_permissions(dataset.id)
         self.log("a public dataset should be manageable to it's owner")
         self.assertTrue(self.dataset_manager.permissions.manage.is_permitted(dataset, owner))
         self.log("a public dataset shouldn't be manageable to just anyone")
@@ -154,8 +362,8 @@ class DatasetManagerTestCase(BaseTestCase):
 
     def test_create_private_dataset(self):
         self.log("should be able to create a new Dataset and give it private permissions")
-        owner = self.user_manager.create(**user2_data)
-        owner_private_role = self.user_manager.private_role(owner)
+        owner = self.get_user(user2_data)
+        owner_private_role = self.get_private_role(owner)
         dataset = self.dataset_manager.create(manage_roles=[owner_private_role], access_roles=[owner_private_role])
 
         permissions = self.dataset_manager.permissions.get(dataset)
@@ -167,12 +375,13 @@ class DatasetManagerTestCase(BaseTestCase):
         self.assertIsInstance(access_permissions, list)
         self.assertIsInstance(access_permissions[0], model.DatasetPermissions)
 
+        dataset = self.by_id_with_permissions(dataset.id)
         self.log("a private dataset should be manageable by it's owner")
         self.assertTrue(self.dataset_manager.permissions.manage.is_permitted(dataset, owner))
         self.log("a private dataset should be accessible to it's owner")
         self.assertTrue(self.dataset_manager.permissions.access.is_permitted(dataset, owner))
 
-        user3 = self.user_manager.create(**user3_data)
+        user3 = self.get_user(user3_data)
         self.log("a private dataset shouldn't be manageable to just anyone")
         self.assertFalse(self.dataset_manager.permissions.manage.is_permitted(dataset, user3))
         self.log("a private dataset shouldn't be accessible to just anyone")
@@ -190,10 +399,53 @@ class DatasetManagerTestCase(BaseTestCase):
 
 
 # =============================================================================
-class DatasetRBACPermissionsTestCase(BaseTestCase):
-    def set_up_managers(self):
-        super().set_up_managers()
-        self.dataset_manager = DatasetManager(self.app)
+class DatasetRBACPermissionsTestCase(BaseDatasetTestCase):
+    dataset_pool_size = 2
+
+    def test_is_permitted_from_permission_rows(self):
+        self.log("permissions inserted as rows should be checked like those set through the manager")
+        owner = self.get_user(user2_data)
+        owner_private_role = self.get_private_role(owner)
+        user3 = self.get_user(user3_data)
+        public = self.get_dataset(0)
+        private = self.get_dataset(1)
+        manage_action = self.dataset_manager.permissions.manage.action_name
+        access_action = self.dataset_manager.permissions.access.action_name
+        self.insert_fixture_rows(
+            self.trans.sa_session,
+            {
+                model.DatasetPermissions: [
+                    dict(action=manage_action, dataset_id=public.id, role_id=owner_private_role.id),
+                    dict(action=manage_action, dataset_id=private.id, role_id=owner_private_role.id),
+                    dict(action=access_action, dataset_id=private.id, role_id=owner_private_role.id),
+                ],
+            },
+        )
+
+        self.log("the fixture roles should be granted as inserted")
+        roles = self.permission_roles_by_action([public, private])
+        owner_role_ids = frozenset([owner_private_role.id])
+        self.assertEqual(roles[manage_action], {public.id: owner_role_ids, private.id: owner_role_ids})
+        self.assertEqual(roles[access_action], {private.id: owner_role_ids})
+
+        self.log("a public dataset should be manageable by only its owner and an admin")
+        public = self.by_id_with_permissions(public.id)
+        self.assertTrue(self.dataset_manager.permissions.manage.is_permitted(public, owner))
+        self.assertTrue(self.dataset_manager.permissions.manage.is_permitted(public, self.admin_user))
+        self.assertFalse(self.dataset_manager.permissions.manage.is_permitted(public, user3))
+        self.assertFalse(self.dataset_manager.permissions.manage.is_permitted(public, None))
+        self.log("a public dataset should be accessible to all")
+        self.assertTrue(self.dataset_manager.permissions.access.is_permitted(public, owner))
+        self.assertTrue(self.dataset_manager.permissions.access.is_permitted(public, self.admin_user))
+        self.assertTrue(self.dataset_manager.permissions.access.is_permitted(public, user3))
+        self.assertTrue(self.dataset_manager.permissions.access.is_permitted(public, None))
+
+        self.log("a private dataset should be accessible by only its owner and an admin")
+        private = self.by_id_with_permissions(private.id)
+        self.assertTrue(self.dataset_manager.permissions.access.is_permitted(private, owner))
+        self.assertTrue(self.dataset_manager.permissions.access.is_permitted(private, self.admin_user))
+        self.assertFalse(self.dataset_manager.permissions.access.is_permitted(private, user3))
+        self.assertFalse(self.dataset_manager.permissions.access.is_permitted(private, None))
 
     # def test_manage( self ):
     #     self.log( "should be able to create a new Dataset" )
@@ -209,16 +461,29 @@ def testable_url_for(*a, **k):
     return f"(fake url): {a}, {k}"
 
 
-@mock.patch("galaxy.managers.datasets.DatasetSerializer.url_for", testable_url_for)
-class DatasetSerializerTestCase(BaseTestCase):
-    def set_up_managers(self):
-        super().set_up_managers()
-        self.dataset_manager = DatasetManager(self.app)
-        self.dataset_serializer = DatasetSerializer(self.app, self.user_manager)
-        self.role_manager = RoleManager(self.app)
+class DatasetSerializerTestCase(BaseDatasetTestCase):
+    dataset_pool_size = 1
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # patched once for the class rather than around each test method
+        cls._url_for_patcher = mock.patch("galaxy.managers.datasets.DatasetSerializer.url_for", testable_url_for)
+        cls._url_for_patcher.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._url_for_patcher.stop()
+        super().tearDownClass()
+
+    @classmethod
+    def set_up_class_managers(cls):
+        super().set_up_class_managers()
+        cls.dataset_serializer = DatasetSerializer(cls.app, cls.user_manager)
+        cls.role_manager = RoleManager(cls.app)
 
     def test_views(self):
-        dataset = self.dataset_manager.create()
+        dataset = self.get_dataset()
 
         self.log("should have a summary view")
         summary_view = self.dataset_serializer.serialize_to_view(dataset, view="summary")
@@ -229,18 +494,17 @@ class DatasetSerializerTestCase(BaseTestCase):
         self.assertKeys(summary_view, self.dataset_serializer.views["summary"])
 
         self.log("should have a serializer for all serializable keys")
-        for key in self.dataset_serializer.serializable_keyset:
-            instantiated_attribute = getattr(dataset, key, None)
-            if not (
-                (key in self.dataset_serializer.serializers)
-                or (isinstance(instantiated_attribute, self.TYPES_NEEDING_NO_SERIALIZERS))
-            ):
-                self.fail(f"no serializer for: {key} ({instantiated_attribute})")
-        else:
-            self.assertTrue(True, "all serializable keys have a serializer")
+        serializers = self.dataset_serializer.serializers
+        types_needing_no_serializers = self.TYPES_NEEDING_NO_SERIALIZERS
+        missing = sorted(
+            key
+            for key in self.dataset_serializer.serializable_keyset
+            if key not in serializers and not isinstance(getattr(dataset, key, None), types_needing_no_serializers)
+        )
+        self.assertEqual(missing, [], f"no serializer for: {missing}")
 
     def test_views_and_keys(self):
-        dataset = self.dataset_manager.create()
+        dataset = self.get_dataset()
 
         self.log("should be able to use keys with views")
         serialized = self.dataset_serializer.serialize_to_view(
@@ -255,9 +519,36 @@ class DatasetSerializerTestCase(BaseTestCase):
         serialized = self.dataset_serializer.serialize_to_view(dataset, keys=["purgable", "file_size"])
         self.assertKeys(serialized, ["purgable", "file_size"])
 
+    def test_serialize_to_view_keys(self):
+        dataset = self.get_dataset()
+        # a serializer of our own: adding views to the shared one would leak into other tests
+        serializer = DatasetSerializer(self.app, self.user_manager)
+
+        self.log("adding a view should replace the keys cached for an already serialized view")
+        serializer.add_view("ids", ["id"])
+        self.assertKeys(serializer.serialize_to_view(dataset, view="ids"), ["id"])
+        serializer.add_view("ids", ["id", "state"])
+        self.assertKeys(serializer.serialize_to_view(dataset, view="ids"), ["id", "state"])
+
+        self.log("serialize should be given a new list of the cached keys on each call")
+        serialize = serializer.serialize
+        given_keys = []
+
+        def serialize_and_clear_keys(item, keys, **context):
+            given_keys.append(keys)
+            serialized = serialize(item, keys, **context)
+            keys.clear()
+            return serialized
+
+        with mock.patch.object(serializer, "serialize", serialize_and_clear_keys):
+            serializer.serialize_to_view(dataset, view="ids")
+            serialized = serializer.serialize_to_view(dataset, view="ids")
+        self.assertIsNot(given_keys[0], given_keys[1])
+        self.assertKeys(serialized, ["id", "state"])
+
     def test_serialize_permissions(self):
-        dataset = self.dataset_manager.create()
-        who_manages = self.user_manager.create(**user2_data)
+        dataset = self.get_dataset()
+        who_manages = self.get_user(user2_data)
         self.dataset_manager.permissions.manage.grant(dataset, who_manages)
 
         self.log("serialized permissions should be returned for the user who can manage and be well formed")
@@ -271,12 +562,12 @@ class DatasetSerializerTestCase(BaseTestCase):
         self.assertTrue(len(manage_perms) == 1)
         role_id = manage_perms[0]
         self.assertEncodedId(role_id)
-        role_id = self.app.security.decode_id(role_id)
-        role = self.role_manager.get(self.trans, role_id)
+        role_id = self.decode_id(role_id)
+        role = self.role_manager.get_with_users(self.trans, role_id)
         self.assertTrue(who_manages in [user_role.user for user_role in role.users])
 
         self.log("permissions should be not returned for non-managing users")
-        not_my_supervisor = self.user_manager.create(**user3_data)
+        not_my_supervisor = self.get_user(user3_data)
         self.assertRaises(
             SkipAttribute, self.dataset_serializer.serialize_permissions, dataset, "perms", user=not_my_supervisor
         )
@@ -291,12 +582,12 @@ class DatasetSerializerTestCase(BaseTestCase):
 
     def test_serializers(self):
         # self.user_manager.create( **user2_data )
-        dataset = self.dataset_manager.create()
+        dataset = self.get_dataset()
         all_keys = list(self.dataset_serializer.serializable_keyset)
         serialized = self.dataset_serializer.serialize(dataset, all_keys)
 
         self.log("everything serialized should be of the proper type")
-        self.assertEncodedId(serialized["id"])
+        self.assertEncodedId(serialized["id"], self.encoded_ids[dataset.id])
         self.assertDate(serialized["create_time"])
         self.assertDate(serialized["update_time"])
 